@@ -5,6 +5,8 @@ import bmtrain as bmt
 import numpy as np
 import os
 import csv
+import math
+from collections import defaultdict
 
 from model_center import get_args
 from model_center.model import CPM1
@@ -19,6 +21,16 @@ def get_tokenizer(args):
 
 def get_model(args):
     model = CPM1.from_pretrained(args.model_config)
+    if args.compile:
+        import torch._dynamo
+        if not getattr(torch._dynamo.config, "inline_inbuilt_nn_modules", False):
+            # without module inlining dynamo guards on each block instance, so every layer is its
+            # own cache entry and layers beyond cache_size_limit would silently run eagerly
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, model.encoder.num_layers)
+        # compile the blocks wrapped by bmtrain rather than the whole model, so dynamo
+        # does not trace through the parameter gathering of CheckpointBlock
+        for block in model.encoder.layers:
+            block._module.compile(dynamic=False)
     return model
 
 def get_optimizer(args, model):
@@ -89,6 +101,51 @@ def initialize():
     return args
 
 
+def _foreach_norm_has_dtype():
+    try:
+        torch._foreach_norm([torch.zeros(1)], 2, dtype=torch.float32)
+    except TypeError:
+        return False
+    return True
+
+# checked once at import, older torch has no dtype argument on _foreach_norm
+FOREACH_NORM_HAS_DTYPE = _foreach_norm_has_dtype()
+
+def clip_grad_norm(param_groups, max_norm, scale, norm_type=2, eps=1e-6):
+    # bucket grads by device and dtype so that every foreach call below takes the fused path
+    grads = defaultdict(list)
+    for group in param_groups:
+        for p in group['params']:
+            if p.grad is not None:
+                grads[(p.grad.device, p.grad.dtype)].append(p.grad)
+    # one foreach launch per bucket for all per-tensor norms instead of a python loop over parameters,
+    # accumulating in fp32 without materializing fp32 copies of the half precision grads
+    norms = []
+    for bucket in grads.values():
+        if FOREACH_NORM_HAS_DTYPE:
+            norms.extend(torch._foreach_norm(bucket, norm_type, dtype=torch.float32))
+        else:
+            norms.extend(torch._foreach_norm([grad.float() for grad in bucket], norm_type))
+    # parameters are partitioned across ranks, so combine the local norms before taking the root;
+    # every rank joins the all_reduce, even one whose shard has no gradient
+    if len(norms) == 0:
+        total_norm = torch.zeros((), dtype=torch.float32, device="cuda")
+    elif norm_type == math.inf:
+        total_norm = torch.stack(norms).max()
+    else:
+        total_norm = torch.linalg.vector_norm(torch.stack(norms), norm_type) ** norm_type
+    if norm_type == math.inf:
+        total_norm = bmt.distributed.all_reduce(total_norm, op="max") / scale
+    else:
+        total_norm = bmt.distributed.all_reduce(total_norm, op="sum") ** (1. / norm_type) / scale
+    clip_coef = torch.clamp(max_norm / (total_norm + eps), max=1.0)
+    # _foreach_mul_ takes the 0-dim cuda clip_coef without a host sync only from torch 2.1 on,
+    # older versions convert it to a python scalar
+    for bucket in grads.values():
+        torch._foreach_mul_(bucket, clip_coef)
+    return total_norm
+
+
 def prepare_dataset(args, tokenizer, base_path, dataset_name, rank, world_size):
     splits = ['train', 'dev', 'test']
     dataset = {}
@@ -104,48 +161,55 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
     optim_manager = bmt.optim.OptimManager(loss_scale=args.loss_scale)
     optim_manager.add_optimizer(optimizer, lr_scheduler)
 
+    # no loader workers: LCQMC is preloaded and a batch is one index_select per field, so workers
+    # would only add inter-process copies of each batch
     dataloader = {
-        "train": DistributedDataLoader(dataset['train'], batch_size=args.batch_size, shuffle=True),
-        "dev": DistributedDataLoader(dataset['dev'], batch_size=args.batch_size, shuffle=False),
-        "test": DistributedDataLoader(dataset['test'], batch_size=args.batch_size, shuffle=False),
+        "train": DistributedDataLoader(dataset['train'], batch_size=args.batch_size, shuffle=True, batched=True, pin_memory=True),
+        "dev": DistributedDataLoader(dataset['dev'], batch_size=args.batch_size, shuffle=False, batched=True, pin_memory=True),
+        "test": DistributedDataLoader(dataset['test'], batch_size=args.batch_size, shuffle=False, batched=True, pin_memory=True),
     }
 
     for epoch in range(5):
         model.train()
+        loss_buf = []
         for it, data in enumerate(dataloader['train']):
-            input_tokens = data["input_tokens"]
-            input_length = data["input_length"]
-            input_context = data["input_context"]
-            input_span = data["input_span"]
-            targets = data["targets"]
-            index = data["index"]
+            input_tokens = data["input_tokens"].cuda(non_blocking=True)
+            input_length = data["input_length"].cuda(non_blocking=True)
+            input_context = data["input_context"].cuda(non_blocking=True)
+            input_span = data["input_span"].cuda(non_blocking=True)
+            targets = data["targets"].cuda(non_blocking=True)
+            index = data["index"].cuda(non_blocking=True)
 
             logits = model(input_tokens, input_length, input_context, input_span)
             # bmt.print_rank(logits[0])
+            logits = logits.gather(1, index.view(-1, 1, 1).expand(-1, 1, logits.shape[-1])).squeeze(1)
             logits = logits.index_select(dim=-1, index=verbalizer)
-            logits = logits[torch.where(index==1)]
 
             loss = loss_func(logits, targets)
-            global_loss = bmt.sum_loss(loss).item()
+            # keep the reduced loss on device, it is only read back when logging
+            loss_buf.append(bmt.sum_loss(loss).detach())
 
             optim_manager.zero_grad()
 
             optim_manager.backward(loss)
-            grad_norm = optim_manager.clip_grad_norm(optimizer.param_groups, args.clip_grad, norm_type = 2)
+            grad_norm = clip_grad_norm(optimizer.param_groups, args.clip_grad, optim_manager.loss_scale, norm_type = 2)
 
             optim_manager.step()
 
-            bmt.print_rank(
-                "train | epoch {:3d} | Iter: {:6d}/{:6d} | loss: {:.4f} | lr: {:.4e}, scale: {:10.4f} | grad_norm: {:.4f} |".format(
-                    epoch,
-                    it,
-                    len(dataloader["train"]),
-                    global_loss,
-                    lr_scheduler.current_lr,
-                    int(optim_manager.loss_scale),
-                    grad_norm
+            if (it + 1) % args.log_iters == 0 or it + 1 == len(dataloader["train"]):
+                global_loss = torch.stack(loss_buf).mean().item()
+                loss_buf = []
+                bmt.print_rank(
+                    "train | epoch {:3d} | Iter: {:6d}/{:6d} | loss: {:.4f} | lr: {:.4e}, scale: {:10.4f} | grad_norm: {:.4f} |".format(
+                        epoch,
+                        it,
+                        len(dataloader["train"]),
+                        global_loss,
+                        lr_scheduler.current_lr,
+                        int(optim_manager.loss_scale),
+                        grad_norm
+                    )
                 )
-            )
             # if it % args.inspect_iters == 0: print_inspect(model, "*")
             # if args.save != None and it % args.save_iters == 0:
             #     bmt.save(model, os.path.join(args.save, args.save_name+("-%d.pt" % it)))
@@ -155,17 +219,18 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
             acc = 0
             total = 0
             for it, data in enumerate(dataloader['dev']):
-                input_tokens = data["input_tokens"]
-                input_length = data["input_length"]
-                input_context = data["input_context"]
-                input_span = data["input_span"]
-                targets = data["targets"]
-                index = data["index"]
+                input_tokens = data["input_tokens"].cuda(non_blocking=True)
+                input_length = data["input_length"].cuda(non_blocking=True)
+                input_context = data["input_context"].cuda(non_blocking=True)
+                input_span = data["input_span"].cuda(non_blocking=True)
+                targets = data["targets"].cuda(non_blocking=True)
+                index = data["index"].cuda(non_blocking=True)
 
                 logits = model(input_tokens, input_length, input_context, input_span)
+                logits = logits.gather(1, index.view(-1, 1, 1).expand(-1, 1, logits.shape[-1])).squeeze(1)
                 logits = logits.index_select(dim=-1, index=verbalizer)
-                logits = logits[torch.where(index==1)]
-                logits = logits.argmax(dim=-1)
+                # argmax over the two verbalizer logits, ties resolve to the first as argmax does
+                logits = (logits[:, 1] > logits[:, 0]).long()
             
                 acc += torch.sum(logits == targets).item()
                 total += logits.shape[0]
@@ -22,6 +22,16 @@ def get_tokenizer(args):
 
 def get_model(args):
     model = GPT2.from_pretrained(args.model_config)
+    if args.compile:
+        import torch._dynamo
+        if not getattr(torch._dynamo.config, "inline_inbuilt_nn_modules", False):
+            # without module inlining dynamo guards on each block instance, so every layer is its
+            # own cache entry and layers beyond cache_size_limit would silently run eagerly
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, model.encoder.num_layers)
+        # compile the blocks wrapped by bmtrain rather than the whole model, so dynamo
+        # does not trace through the parameter gathering of CheckpointBlock
+        for block in model.encoder.layers:
+            block._module.compile(dynamic=False)
     return model
 
 def get_optimizer(args, model):
@@ -115,6 +125,9 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
         }
 
         model.train()
+        loss_buf = []
+        torch.cuda.synchronize()
+        st_time = time.time()
         for it, data in enumerate(dataloader['train']):
             input_ids = data["input_ids"]
             input_length = data["input_length"]
@@ -122,17 +135,15 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
             targets = data["targets"]
             index = data["index"]
 
-            torch.cuda.synchronize()
-            st_time = time.time()
-
             logits = model(input_ids, input_length, output_logits=True).logits
 
             loss = loss_func(logits.view(-1, logits.shape[-1]), targets.view(-1))
 
+            logits = logits.gather(1, index.view(-1, 1, 1).expand(-1, 1, logits.shape[-1])).squeeze(1)
             logits = logits.index_select(dim=-1, index=verbalizer)
-            logits = logits[torch.where(index==1)]
             loss = loss + loss_func(logits, labels)
-            global_loss = bmt.sum_loss(loss).item()
+            # keep the reduced loss on device, it is only read back when logging
+            loss_buf.append(bmt.sum_loss(loss).detach())
 
             optim_manager.zero_grad()
 
@@ -141,21 +152,26 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
 
             optim_manager.step()
 
-            torch.cuda.synchronize()
-            elapsed_time = time.time() - st_time
-
-            bmt.print_rank(
-                "train | epoch {:3d} | Iter: {:6d}/{:6d} | loss: {:.4f} | lr: {:.4e}, scale: {:10.4f} | grad_norm: {:.4f} | time: {:.3f}".format(
-                    epoch,
-                    it,
-                    len(dataloader["train"]),
-                    global_loss,
-                    lr_scheduler.current_lr,
-                    int(optim_manager.loss_scale),
-                    grad_norm,
-                    elapsed_time,
+            if (it + 1) % args.log_iters == 0 or it + 1 == len(dataloader["train"]):
+                torch.cuda.synchronize()
+                # wall time per iteration averaged over the log window, including data loading and logging
+                elapsed_time = (time.time() - st_time) / len(loss_buf)
+                global_loss = torch.stack(loss_buf).mean().item()
+                loss_buf = []
+
+                bmt.print_rank(
+                    "train | epoch {:3d} | Iter: {:6d}/{:6d} | loss: {:.4f} | lr: {:.4e}, scale: {:10.4f} | grad_norm: {:.4f} | avg_iter_time: {:.3f}".format(
+                        epoch,
+                        it,
+                        len(dataloader["train"]),
+                        global_loss,
+                        lr_scheduler.current_lr,
+                        int(optim_manager.loss_scale),
+                        grad_norm,
+                        elapsed_time,
+                    )
                 )
-            )
+                st_time = time.time()
             # if it % args.inspect_iters == 0: print_inspect(model, "*")
             # if args.save != None and it % args.save_iters == 0:
             #     bmt.save(model, os.path.join(args.save, args.save_name+("-%d.pt" % it)))
@@ -163,7 +179,7 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
         model.eval()
         with torch.no_grad():
             for split in ['dev']:
-                pd = []
+                pd = [] # predictions stay on the gpu until the loop ends to avoid a sync per iteration
                 gt = []
                 for it, data in enumerate(dataloader[split]):
                     input_ids = data["input_ids"]
@@ -172,12 +188,16 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
                     index = data["index"]
 
                     logits = model(input_ids, input_length, output_logits=True).logits
+                    logits = logits.gather(1, index.view(-1, 1, 1).expand(-1, 1, logits.shape[-1])).squeeze(1)
                     logits = logits.index_select(dim=-1, index=verbalizer)
-                    logits = logits[torch.where(index==1)]
-                    logits = logits.argmax(dim=-1)
+                    if logits.shape[-1] == 2:
+                        # argmax over two verbalizer logits, ties resolve to the first as argmax does
+                        logits = (logits[:, 1] > logits[:, 0]).long()
+                    else:
+                        logits = logits.argmax(dim=-1)
                 
-                    pd.extend(logits.cpu().tolist())
-                    gt.extend(labels.cpu().tolist())
+                    pd.append(logits)
+                    gt.append(labels)
 
                     bmt.print_rank(
                         "{} | epoch {:3d} | Iter: {:6d}/{:6d} |".format(
@@ -187,8 +207,8 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
                             len(dataloader[split]),
                         )
                     )
-                pd = bmt.gather_result(torch.tensor(pd).int()).cpu().tolist()
-                gt = bmt.gather_result(torch.tensor(gt).int()).cpu().tolist()
+                pd = bmt.gather_result(torch.cat(pd).int()).cpu().tolist()
+                gt = bmt.gather_result(torch.cat(gt).int()).cpu().tolist()
                 bmt.print_rank(pd)
                 bmt.print_rank(gt)
                 
@@ -128,8 +128,8 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
             index = data["index"]
 
             logits = model(input_ids, input_length, output_logits=True).logits
+            logits = logits.gather(1, index.view(-1, 1, 1).expand(-1, 1, logits.shape[-1])).squeeze(1)
             logits = logits.index_select(dim=-1, index=verbalizer)
-            logits = logits[torch.where(index==1)]
 
             loss = loss_func(logits, targets)
             # loss = loss_func(logits.view(-1, logits.shape[-1]), targets.view(-1))
@@ -169,8 +169,8 @@ def finetune(args, tokenizer, model, optimizer, lr_scheduler, dataset, verbalize
                     index = data["index"]
 
                     logits = model(input_ids, input_length, output_logits=True).logits
+                    logits = logits.gather(1, index.view(-1, 1, 1).expand(-1, 1, logits.shape[-1])).squeeze(1)
                     logits = logits.index_select(dim=-1, index=verbalizer)
-                    logits = logits[torch.where(index==1)]
                     logits = logits.argmax(dim=-1)
                 
                     pd.extend(logits.cpu().tolist())
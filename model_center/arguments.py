@@ -42,6 +42,8 @@ def add_training_args(parser: argparse.ArgumentParser):
                        help='number of iterations between saves')
     group.add_argument('--inspect-iters', type=int, default=1000,
                        help='number of inspecting')
+    group.add_argument('--log-iters', type=int, default=10,
+                       help='number of iterations between training logs')
     group.add_argument('--batch-size', type=int, default=32,
                        help='Data Loader batch size')
     group.add_argument('--clip-grad', type=float, default=1.0,
@@ -81,6 +83,8 @@ def add_training_args(parser: argparse.ArgumentParser):
                        help='learning rate decay function')
     group.add_argument('--local_rank', type=int, default=None,
                        help='local rank passed from distributed launcher')
+    group.add_argument('--compile', action='store_true',
+                       help='compile the transformer blocks with torch.compile (requires torch>=2.2)')
 
     return parser
 
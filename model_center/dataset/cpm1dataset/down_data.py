@@ -14,60 +14,62 @@
 # limitations under the License.
 import torch
 import csv
-import numpy as np
 
 class LCQMC_Dataset(torch.utils.data.Dataset):
     def __init__(self, path, split, rank, world_size, tokenizer, max_length) -> None:
-        self.data = []
-
         path = f"{path}/LCQMC/{split}.tsv"
         with open(path, encoding='utf8') as fin:
             reader = list(csv.reader(fin, delimiter='\t'))[1:]
-            for i, row in enumerate(reader):
-                text_a, text_b, label = row
-                lef_tokens = [1] + tokenizer.encode(f'"{text_a}"与"{text_b}"的关系是:')
-                rig_tokens = tokenizer.encode("。")
 
-                input_tokens, input_length, context, input_span = self.make_input(lef_tokens, rig_tokens, 1, max_length)
+        rig_tokens = tokenizer.encode("。")
+        lef_tokens = [[1] + tokenizer.encode(f'"{text_a}"与"{text_b}"的关系是:') for text_a, text_b, _ in reader]
+
+        input_tokens, input_length, context, input_span = self.make_input(lef_tokens, rig_tokens, 1, max_length)
 
-                index = torch.zeros((max_length,), dtype=torch.int32)
-                index[len(lef_tokens) - 1] = 1
+        # position of the answer token, used to pick its logits without a dynamic-shape mask
+        index = torch.tensor([len(lef) - 1 for lef in lef_tokens], dtype=torch.long)
 
-                target = torch.tensor(int(label), dtype=torch.long)
+        target = torch.tensor([int(label) for _, _, label in reader], dtype=torch.long)
 
-                self.data.append({
-                    "input_tokens": input_tokens.cuda(),
-                    "input_length": input_length.cuda(),
-                    "input_context": context.cuda(),
-                    "input_span": input_span.cuda(),
-                    "targets": target.cuda(),
-                    "index": index.cuda(),
-                })
+        # each field is one contiguous (N, ...) tensor so a batch is a single index_select
+        self.data = {
+            "input_tokens": input_tokens,
+            "input_length": input_length,
+            "input_context": context,
+            "input_span": input_span,
+            "targets": target,
+            "index": index,
+        }
 
     def make_input(self, lef_tokens, rig_tokens, spans, max_length):
-        input = lef_tokens + [0 for i in range(spans)] + rig_tokens
-        length = len(input)
+        inputs = [lef + [0 for i in range(spans)] + rig_tokens for lef in lef_tokens]
+        length = [len(input) for input in inputs]
 
-        assert length < max_length # TODO
+        assert max(length, default=0) < max_length # TODO
 
-        input_tokens = torch.zeros((max_length,), dtype=torch.int32)
-        input_tokens[:length] = torch.tensor(input).int()
+        input_tokens = torch.zeros((len(inputs), max_length), dtype=torch.int32)
+        for i, input in enumerate(inputs):
+            input_tokens[i, :length[i]] = torch.tensor(input).int()
 
         input_length = torch.tensor(length, dtype=torch.int32)
 
-        context = np.arange(max_length)
-        context = (context < len(lef_tokens)) | (context >= len(lef_tokens) + spans)
-        context = torch.from_numpy(context).bool()
+        arange = torch.arange(max_length, dtype=torch.int32)
+        lef_length = torch.tensor([len(lef) for lef in lef_tokens], dtype=torch.int32)
+        context = (arange[None, :] < lef_length[:, None]) | (arange[None, :] >= lef_length[:, None] + spans)
 
-        input_span = torch.zeros((max_length,), dtype=torch.int32)
+        input_span = torch.zeros((len(inputs), max_length), dtype=torch.int32)
 
         return input_tokens, input_length, context, input_span
 
     def __len__(self):
-        return len(self.data)
+        return self.data["targets"].shape[0]
     
     def __getitem__(self, idx):
-        return self.data[idx]
+        if isinstance(idx, (list, tuple)):
+            # a list of indices returns an already collated batch
+            idx = torch.as_tensor(idx, dtype=torch.long)
+            return {key: value.index_select(0, idx) for key, value in self.data.items()}
+        return {key: value[idx] for key, value in self.data.items()}
 
     @classmethod
     def get_verbalizer(cls, tokenizer):
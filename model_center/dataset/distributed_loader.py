@@ -16,9 +16,14 @@ import torch.utils.data as data
 import bmtrain as bmt
 
 class DistributedDataLoader:
-    def __init__(self, dataset, shuffle=False, seed=0, **kwargs):
+    def __init__(self, dataset, shuffle=False, seed=0, batched=False, **kwargs):
         self.sampler = data.distributed.DistributedSampler(dataset, shuffle=shuffle, seed=seed, rank=bmt.rank(), num_replicas=bmt.world_size())
-        self.loader = data.DataLoader(dataset, shuffle=False, sampler=self.sampler, **kwargs)
+        if batched:
+            # the dataset indexes a whole list of indices at once and returns a collated batch
+            batch_sampler = data.BatchSampler(self.sampler, kwargs.pop("batch_size", 1), kwargs.pop("drop_last", False))
+            self.loader = data.DataLoader(dataset, batch_size=None, sampler=batch_sampler, **kwargs)
+        else:
+            self.loader = data.DataLoader(dataset, shuffle=False, sampler=self.sampler, **kwargs)
         self.epoch = 0
         self.shuffle = shuffle
 
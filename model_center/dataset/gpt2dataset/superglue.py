@@ -41,8 +41,7 @@ class SuperGLUE(torch.utils.data.Dataset):
 
         labels = torch.tensor(label, dtype=torch.long)
 
-        index = torch.zeros((max_decoder_length,), dtype=torch.int32)
-        index[length - 1] = 1
+        index = torch.tensor(length - 1, dtype=torch.long)
 
         self.data.append({
             "input_ids": input_tokens.cuda(),
@@ -547,7 +547,7 @@ class TransformerBlock(torch.nn.Module):
         """    
         current_key_value = None
         if not self.mask_att:
-            # (batch, dim_model, seq_self)
+            # (batch, seq_self, dim_model)
             # add positional bias on sparse attention in the future
             hidden_states = self.self_att(self_hidden_states,
                                         attention_mask = self_attention_mask,
@@ -561,13 +561,13 @@ class TransformerBlock(torch.nn.Module):
 
         if self.is_decoder and self.cross_att is not None:
             if not self.mask_cross:
-                # (batch, dim_model, seq_self)
+                # (batch, seq_self, dim_model)
                 hidden_states = self.cross_att(hidden_states = hidden_states,
                                             key_value_states = cross_hidden_states,
                                             attention_mask = cross_attention_mask,
                                             position_bias = cross_position_bias)
         if not self.mask_ffn:
-            # (batch, dim_model, seq_self)
+            # (batch, seq_self, dim_model)
             if self.parallel_ffn:
                 hidden_states_2 = self.ffn(self_hidden_states)
                 hidden_states = hidden_states - self_hidden_states + hidden_states_2
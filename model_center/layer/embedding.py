@@ -62,6 +62,7 @@ class Embedding(bmt.DistributedModule):
                 self.weight.data[self.padding_idx].fill_(0)
 
         self.length_scale = length_scale
+        self.scale = 1.0 / math.sqrt(embedding_size)
         self.int8 = int8
 
     def forward(self, ids : torch.Tensor):
@@ -75,7 +76,8 @@ class Embedding(bmt.DistributedModule):
         
         embeds = F.embedding(ids, self.weight,self.padding_idx)
         if self.length_scale:
-            embeds = embeds / math.sqrt(self.dim_model)
+            # the lookup output is a fresh tensor not saved for backward, so scale it in place
+            embeds = embeds.mul_(self.scale)
         return embeds
     
     def projection(self, x : torch.Tensor):
@@ -88,7 +90,8 @@ class Embedding(bmt.DistributedModule):
             :obj:`torch.Tensor` of shape ``(batch, seq_len, vocab_output_size)``: The projection output.
         """
         if self.length_scale:
-            x = x / math.sqrt(self.dim_model)
+            # scale the (batch, seq_len, dim_model) input rather than the much larger logits
+            x = x * self.scale
         logits = F.linear(x, self.weight)
         return logits
 